@@ -2,25 +2,37 @@ from flask import Blueprint, request, Response, send_file, redirect
 import os
 from pathlib import Path
 import hashlib
-import subprocess
 import shutil
-import threading
 
 import config
-from cache import cache
+from metrics import Counter, Gauge, Histogram, worker_id, worker_ids
+import ratelimit
+import outbound
+import blocking
 
 import hashlib
 import hmac
 import secrets
 import json
-from datetime import date
-import random
+from datetime import date, datetime, time, timedelta
 import tarfile
-import requests
 import traceback
 
+try:
+    import uwsgidecorators
+except ImportError:
+    # not running under uwsgi, e.g. the flask development server or the benchmark
+    uwsgidecorators = None
+
 from api.impl.imhex.telemetry import update_telemetry, increment_crash_count
-from api.impl.imhex.store import gen_store, STORE_FOLDERS
+from api.impl.imhex.database import total_queue_depth
+from api.impl.imhex.store import gen_store_index, publish_by_hash, prune_by_hash, store_hashes, StoreIndex, STORE_FOLDERS
+from api.impl.imhex.build import BuildArtifact, build_lock, bump_generation, is_build_current, swap_folder, write_artifact, write_manifest
+from api.impl.imhex.tips import compile_tips, tip_of_the_day
+from api.impl.imhex.bundle import prune_bundles, select_entries, stream_bundle, write_bundle
+from api.impl.imhex.scheduler import BuildScheduler
+from api.impl.imhex import mirror
+from api.impl.imhex.releases import latest_tag
 
 from api.impl.imhex.crash_file_parser import crash_log
 
@@ -29,46 +41,148 @@ app = Blueprint(api_name, __name__, url_prefix = "/" + api_name)
 
 app_data_folder = Path(config.Common.DATA_FOLDER) / api_name
 app_content_folder = Path(config.Common.CONTENT_FOLDER) / api_name
+by_hash_folder = Path(config.Common.CONTENT_FOLDER) / config.Common.CONTENT_BY_HASH_FOLDER
 
 tips_folder = "tips"
 
+UPDATE_DURATION = Histogram("imhex_update_data_duration_seconds", "Time spent pulling and rebuilding the store content")
+UPDATE_FAILURES = Counter("imhex_update_data_failures_total", "Number of store content rebuilds that raised an exception")
+STORE_DURATION = Histogram("imhex_gen_store_duration_seconds", "Time spent generating the store index of a build")
+CRASH_PARSE_FAILURES = Counter("imhex_crash_parse_failures_total", "Number of uploaded crash logs that couldn't be parsed")
+CRASH_WEBHOOK_DURATION = Histogram("imhex_crash_webhook_duration_seconds", "Time spent posting crash reports to the webhook", ("valid",))
+CRASH_WEBHOOKS_IN_FLIGHT = Gauge("imhex_crash_webhooks_in_flight", "Number of crash reports a worker is currently posting to the webhook", ("worker",))
+
+def database_overloaded() -> bool:
+    return total_queue_depth() > config.ImHexApi.MAX_DATABASE_QUEUE_DEPTH
+
+def crash_webhooks_in_flight() -> float:
+    """
+    Number of crash reports all workers are currently posting to the webhook
+    """
+    return sum(CRASH_WEBHOOKS_IN_FLIGHT.get(worker = worker) for worker in worker_ids())
+
+def crash_reporting_overloaded() -> bool:
+    return database_overloaded() or crash_webhooks_in_flight() >= config.ImHexApi.MAX_CRASH_WEBHOOKS_IN_FLIGHT
+
+def reset_crash_webhooks_in_flight():
+    # posts of a worker that died or was reloaded never finish, its replacement starts from zero
+    CRASH_WEBHOOKS_IN_FLIGHT.set(0, worker = worker_id())
+
+if uwsgidecorators is not None:
+    uwsgidecorators.postfork(reset_crash_webhooks_in_flight)
+
+def telemetry_client_keys():
+    data = request.get_json(silent = True)
+    return [ ratelimit.client_ip(), data.get("uuid") if isinstance(data, dict) and isinstance(data.get("uuid"), str) else None ]
+
 def setup():
-    os.system(f"git -C {app_data_folder} clone https://github.com/WerWolv/ImHex-Patterns --recurse-submodules")
+    if (app_data_folder / "ImHex-Patterns" / ".git").exists():
+        return
 
-def init():
-    update_data()
-    pass
+    mirror.clone(config.ImHexApi.PATTERNS_REPO_URL, app_data_folder / "ImHex-Patterns", config.ImHexApi.PATTERNS_BRANCH, config.ImHexApi.PATTERNS_MIRROR_MODE)
 
-def update_git_repo(repo):
-    repo_dir = app_data_folder / repo
-    subprocess.call([ "git", "reset", "--hard" ], cwd = repo_dir)
-    subprocess.call([ "git", "clean", "-fd" ], cwd = repo_dir)
-    subprocess.call([ "git", "pull" ], cwd = repo_dir)
+def request_startup_build():
+    if is_build_current(app_data_folder, app_content_folder, app_data_folder / "ImHex-Patterns"):
+        print("Store content is up to date, skipping build")
+        return
 
-def update_data():
-    try:
-        print("Pulling changes...")
-        update_git_repo("ImHex-Patterns")
-    
-        if app_content_folder.exists():
-            shutil.rmtree(app_content_folder)
-        os.makedirs(app_content_folder)
-
-        print("Taring...")
-        for store_folder in STORE_FOLDERS:
-            store_path = app_data_folder / "ImHex-Patterns" / store_folder
-            for entry in store_path.iterdir():
-                if entry.is_dir():
-                    shutil.make_archive(entry, "tar", entry)
-
-        print("Copying...")
-        for folder in STORE_FOLDERS:
-            shutil.copytree(app_data_folder / "ImHex-Patterns" / folder, app_content_folder / folder, False, shutil.ignore_patterns('_schema.json'))
-
-        print("Done!")
-    finally:
-        cache.set("store_up_to_date", False)
-        cache.set("updater_running", False)
+    # build in the background, requests are served from the last good build in the meantime
+    build_scheduler.request("startup", immediate = True)
+
+def init():
+    if uwsgidecorators is None:
+        request_startup_build()
+        return
+
+    # threads started in the uwsgi master barely get to run and would be inherited mid-build by the forked workers,
+    # so the first worker requests the build instead. It's checked again whenever that worker is respawned
+    def request_from_first_worker():
+        if worker_id() == 1:
+            request_startup_build()
+
+    uwsgidecorators.postfork(request_from_first_worker)
+
+def update_data() -> str:
+    # the scheduler only runs one build at a time, this guards against anything building outside of it
+    with build_lock(app_data_folder) as acquired:
+        if not acquired:
+            raise RuntimeError("Another process is already building")
+
+        try:
+            with UPDATE_DURATION.time():
+                return build_data()
+        except Exception:
+            UPDATE_FAILURES.inc()
+            raise
+
+tips_index = BuildArtifact(app_data_folder, "tips")
+store_index = BuildArtifact(app_data_folder, "store", StoreIndex)
+
+build_scheduler = BuildScheduler(app_data_folder, update_data, debounce = config.ImHexApi.BUILD_DEBOUNCE, max_delay = config.ImHexApi.BUILD_MAX_DELAY)
+
+def stage_content(repo_dir: Path, staging_folder: Path):
+    """
+    Copy the store folders of the checkout to the staging folder, with every subfolder packed into a tar as well
+    """
+    if staging_folder.exists():
+        shutil.rmtree(staging_folder)
+    os.makedirs(staging_folder)
+
+    print("Taring...")
+    for store_folder in STORE_FOLDERS:
+        store_path = repo_dir / store_folder
+        for entry in store_path.iterdir():
+            if entry.is_dir():
+                shutil.make_archive(entry, "tar", entry)
+
+    print("Copying...")
+    for folder in STORE_FOLDERS:
+        shutil.copytree(repo_dir / folder, staging_folder / folder, False, shutil.ignore_patterns('_schema.json'))
+
+def build_data() -> str:
+    repo_dir = app_data_folder / "ImHex-Patterns"
+
+    print("Pulling changes...")
+    revision = mirror.update(repo_dir, config.ImHexApi.PATTERNS_BRANCH, config.ImHexApi.PATTERNS_MIRROR_MODE)
+
+    # build into a staging folder so the last good build keeps being served until this one is complete.
+    # the disk heavy steps go through `blocking` so they don't stall a gevent worker, the ones running git or plcli
+    # are cooperative already
+    staging_folder = app_content_folder.with_name(api_name + ".new")
+    blocking.call(stage_content, repo_dir, staging_folder)
+
+    print("Indexing...")
+    tips_index_data = blocking.call(compile_tips, repo_dir / tips_folder)
+    with STORE_DURATION.time():
+        store_index_data = gen_store_index(staging_folder, repo_dir)
+        store_index_data["revision"] = revision
+
+    blocking.call(publish_by_hash, staging_folder, store_index_data["store"], by_hash_folder)
+
+    print("Bundling...")
+    bundles_folder = app_data_folder / "bundles"
+    os.makedirs(bundles_folder, exist_ok = True)
+    blocking.call(write_bundle, bundles_folder / f"{revision}.tar.gz", staging_folder, store_index_data["store"])
+
+    # keep the files of the build that's being served, clients may still be working off its listing
+    previous_index = store_index.get()
+
+    # the artifacts only change once everything they point at is in place, so a failed build leaves the
+    # last good one untouched
+    blocking.call(swap_folder, staging_folder, app_content_folder)
+    blocking.call(write_artifact, app_data_folder, "tips", tips_index_data)
+    blocking.call(write_artifact, app_data_folder, "store", store_index_data)
+    write_manifest(app_data_folder, revision)
+    bump_generation()
+
+    prune_bundles(bundles_folder)
+    keep = store_hashes(store_index_data["store"])
+    if previous_index is not None:
+        keep |= store_hashes(previous_index.store)
+    blocking.call(prune_by_hash, by_hash_folder, keep)
+
+    print(f"Done building {revision}!")
+    return revision
 
 @app.route("/pattern_hook", methods = [ 'POST' ])
 def pattern_hook():
@@ -79,19 +193,45 @@ def pattern_hook():
 
 
     if hmac.compare_digest(signature, request.headers['X-Hub-Signature'].split('=')[1]):
+        # pushes to other branches don't affect the store
+        payload = request.get_json(silent = True)
+        if not isinstance(payload, dict):
+            payload = {}
+
+        if payload.get("ref", f"refs/heads/{config.ImHexApi.PATTERNS_BRANCH}") != f"refs/heads/{config.ImHexApi.PATTERNS_BRANCH}":
+            return Response(status = 200)
+
         print("Repository push detected!")
 
-        if not cache.get("updater_running"):
-            cache.set("updater_running", True)
-            threading.Thread(target = update_data).start()
-        else:
-            print("Already updating. Skipped building again")
+        if build_scheduler.request(f"push {str(payload.get('after') or '')[:12]}".strip()) == "queued":
+            print("Build already scheduled. Coalescing push into it")
 
         return Response(status = 200)
     else:
         return Response(status = 401)
 
+@app.route("/build_status")
+def get_build_status():
+    return build_scheduler.status()
+
+def post_crash_webhook(form_data, valid: bool):
+    """
+    Post a crash report to the webhook in the background. The report counts as in flight until the post is done,
+    so a slow webhook makes new uploads get rejected instead of piling up
+    """
+    CRASH_WEBHOOKS_IN_FLIGHT.inc(worker = worker_id())
+
+    def post():
+        try:
+            with CRASH_WEBHOOK_DURATION.time(valid = valid):
+                outbound.post(config.ImHexApi.CRASH_WEBHOOK, files = form_data)
+        finally:
+            CRASH_WEBHOOKS_IN_FLIGHT.dec(worker = worker_id())
+
+    outbound.submit(post)
+
 @app.route("/crash_upload", methods = [ 'POST' ])
+@ratelimit.limit("crash_upload", config.ImHexApi.CRASH_UPLOAD_RATE, config.ImHexApi.CRASH_UPLOAD_BURST, overloaded = crash_reporting_overloaded)
 def crash_upload():
     if "file" not in request.files:
         return Response(status = 400)
@@ -103,65 +243,116 @@ def crash_upload():
 
     increment_crash_count()
 
-    log = crash_log(file.stream.read().decode("utf-8"))
+    # the request is gone by the time the webhook is posted, so keep the file around
+    contents = file.stream.read()
+    log = crash_log(contents.decode("utf-8"))
 
     try:
         log.parse()
     except Exception:
+        CRASH_PARSE_FAILURES.inc()
         print(traceback.format_exc())
 
     if log.valid:
         data = log.build_embed()
-        
-        file.stream.seek(0)
 
         form_data = {
             'payload_json': (None, json.dumps(data), 'application/json'),
-            'file': (file.filename, file.stream, file.mimetype)
+            'file': (file.filename, contents, file.mimetype)
         }
-
-        return requests.post(config.ImHexApi.CRASH_WEBHOOK, files = form_data).text
-    else:       
-        file.stream.seek(0)
-
+    else:
         form_data = {
-            'file': (file.filename, file.stream, file.mimetype)
+            'file': (file.filename, contents, file.mimetype)
         }
 
-        return requests.post(config.ImHexApi.CRASH_WEBHOOK, files = form_data).text
+    post_crash_webhook(form_data, log.valid)
+
+    return Response(status = 200, response = "OK")
 
 @app.route("/store")
-def store():   
-    if not cache.get("store_up_to_date"):
-        cache.set("store_up_to_date", True)
-        cache.set("store", gen_store(request.root_url))
+def store():
+    index = store_index.get()
+    if index is None:
+        return Response(status = 503)
 
-    return cache.get("store")
+    return index.render(request.root_url)
 
-@app.route("/tip")
-def get_tip():    
-    current_day = date.today().weekday()
+@app.route("/store/bundle")
+def store_bundle():
+    index = store_index.get()
+    if index is None:
+        return Response(status = 503)
 
-    if cache.get("tip_update_date") != current_day:
-        cache.set("tip_update_date", current_day)
+    # e.g. ?folders=patterns,includes&entries=magic/elf.mgc
+    folders = [ folder for value in request.args.getlist("folders") for folder in value.split(",") if folder ]
+    entries = [ entry for value in request.args.getlist("entries") for entry in value.split(",") if entry ]
 
-        files = [file for file in (app_data_folder / "ImHex-Patterns" / tips_folder).iterdir()]
-        files = [file for file in files if file.name != "_schema.json"]
-        
-        with open(random.choice(files)) as fd:
-            json_data = json.load(fd)
-            tips = json_data['tips']
-            cache.set("tip", random.choice(tips))
+    if not folders and not entries:
+        return send_file(app_data_folder / "bundles" / f"{index.revision}.tar.gz", mimetype = "application/gzip", as_attachment = True,
+                         download_name = f"imhex-store-{index.revision[:12]}.tar.gz", etag = index.revision)
+
+    store = select_entries(index.store, folders, entries)
+    if not store:
+        return Response(status = 404)
+
+    return Response(stream_bundle(by_hash_folder, store), mimetype = "application/gzip", headers = { "Content-Disposition": "attachment; filename=imhex-store.tar.gz" })
+
+@app.route("/store/lookup")
+def store_lookup():
+    index = store_index.get()
+    if index is None:
+        return Response(status = 503)
+
+    if "mime" not in request.args:
+        return Response(status = 400)
+
+    return { "entries": index.lookup_mime(request.root_url, request.args["mime"]) }
 
+@app.route("/store/search")
+def store_search():
+    index = store_index.get()
+    if index is None:
+        return Response(status = 503)
 
-    return cache.get("tip")
+    if "q" not in request.args:
+        return Response(status = 400)
+
+    limit = max(1, min(request.args.get("limit", 10, type = int), 50))
+    return { "entries": index.search(request.root_url, request.args["q"], request.args.get("folder"), limit) }
+
+@app.route("/store/stats")
+def get_store_stats():
+    index = store_index.get()
+    if index is None:
+        return Response(status = 503)
 
-def get_tag():
-    return requests.get("https://api.github.com/repos/WerWolv/ImHex/releases/latest").json()["tag_name"]
+    return { "folders": index.stats, "total": index.total }
+
+@app.route("/tip")
+def get_tip():
+    tips = tips_index.get()
+    if tips is None:
+        return Response(status = 503)
+
+    now = datetime.now()
+    try:
+        day = date.fromisoformat(request.args["date"]) if "date" in request.args else now.date()
+    except ValueError:
+        return Response(status = 400)
+
+    tip = tip_of_the_day(tips, day, request.args.get("lang"))
+    if tip is None:
+        return Response(status = 404)
+
+    # the tip only changes at midnight
+    response = Response(tip)
+    response.cache_control.public = True
+    response.cache_control.max_age = int((datetime.combine(now.date() + timedelta(days = 1), time.min) - now).total_seconds())
+    return response
 
 @app.route("/update/<release>/<os>")
 def get_update_link(release, os):
-    tag = get_tag()
+    tag = latest_tag()
 
     if release == "latest":
         base = f"https://github.com/WerWolv/ImHex/releases/download/{tag}/imhex-{tag[1:]}"
@@ -236,6 +427,7 @@ def go_to_download(release, os):
 
 required_telemetry_post_fields = [ "uuid", "format_version", "imhex_version", "imhex_commit", "install_type", "os", "os_version", "arch", "gpu_vendor" ]
 @app.route("/telemetry", methods = [ 'POST' ])
+@ratelimit.limit("telemetry", config.ImHexApi.TELEMETRY_RATE, config.ImHexApi.TELEMETRY_BURST, keys = telemetry_client_keys, overloaded = database_overloaded)
 def post_telemetry():
     data = request.json
 
@@ -261,7 +453,11 @@ def post_telemetry():
     
 @app.route("/pattern_count")
 def get_pattern_count():
-    return str(len([file for file in (app_data_folder / "ImHex-Patterns" / "patterns").iterdir() if file.is_file()]))
+    index = store_index.get()
+    if index is None:
+        return Response(status = 503)
+
+    return str(index.stats["patterns"]["count"])
 
 @app.route("/info/<os>/<type>")
 def get_banner_info(os, type):
@@ -0,0 +1,146 @@
+from typing import Callable, Generic, Optional, TypeVar
+from pathlib import Path
+from datetime import datetime, timezone
+import os
+import json
+import shutil
+import fcntl
+import subprocess
+import contextlib
+
+from shared import SharedTable
+
+MANIFEST_FILE = "build_manifest.json"
+LOCK_FILE = "build.lock"
+ARTIFACTS_FOLDER = "index"
+
+# bumped whenever builds produce new or different artifacts, so older builds aren't considered current anymore
+BUILD_FORMAT = 5
+
+# counts finished builds, so every worker process notices when it has to reload the build artifacts
+_generation = SharedTable(capacity = 1, width = 1)
+
+T = TypeVar("T")
+
+def read_manifest(data_folder: Path) -> Optional[dict]:
+    """
+    Read the manifest of the last successful build, or None if there is none
+    """
+    try:
+        with open(data_folder / MANIFEST_FILE) as fd:
+            return json.load(fd)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def write_manifest(data_folder: Path, revision: str, **extra) -> dict:
+    """
+    Atomically replace the build manifest, so readers never see a partially written one
+    """
+    manifest = {
+        "revision": revision,
+        "format": BUILD_FORMAT,
+        "built_at": datetime.now(timezone.utc).isoformat(),
+        **extra
+    }
+
+    temp_file = data_folder / (MANIFEST_FILE + ".tmp")
+    with open(temp_file, "w") as fd:
+        json.dump(manifest, fd)
+    os.replace(temp_file, data_folder / MANIFEST_FILE)
+
+    return manifest
+
+def git_head(repo_dir: Path) -> Optional[str]:
+    """
+    Get the commit hash currently checked out in a repository, or None if it isn't one
+    """
+    result = subprocess.run([ "git", "rev-parse", "HEAD" ], cwd = repo_dir, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL)
+    if result.returncode != 0:
+        return None
+
+    return result.stdout.decode().strip() or None
+
+def is_build_current(data_folder: Path, content_folder: Path, repo_dir: Path) -> bool:
+    """
+    Check if the last successful build was made from the revision that's currently checked out
+    """
+    manifest = read_manifest(data_folder)
+    if manifest is None or manifest.get("format") != BUILD_FORMAT or not content_folder.exists():
+        return False
+
+    revision = git_head(repo_dir)
+    return revision is not None and manifest["revision"] == revision
+
+@contextlib.contextmanager
+def build_lock(data_folder: Path):
+    """
+    Take the cross process build lock without blocking. Yields whether the lock could be acquired
+    """
+    with open(data_folder / LOCK_FILE, "w") as fd:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+def swap_folder(staging_folder: Path, target_folder: Path):
+    """
+    Replace `target_folder` with `staging_folder`. Both are renames, so the target is only missing for an instant
+    """
+    old_folder = target_folder.with_name(target_folder.name + ".old")
+    if old_folder.exists():
+        shutil.rmtree(old_folder)
+
+    if target_folder.exists():
+        os.rename(target_folder, old_folder)
+    os.rename(staging_folder, target_folder)
+
+    if old_folder.exists():
+        shutil.rmtree(old_folder)
+
+def write_artifact(data_folder: Path, name: str, value):
+    """
+    Atomically write an artifact of the current build, to be loaded by the workers through `BuildArtifact`
+    """
+    artifacts_folder = data_folder / ARTIFACTS_FOLDER
+    artifacts_folder.mkdir(exist_ok = True)
+
+    temp_file = artifacts_folder / (name + ".json.tmp")
+    with open(temp_file, "w") as fd:
+        json.dump(value, fd)
+    os.replace(temp_file, artifacts_folder / (name + ".json"))
+
+def bump_generation():
+    _generation.add("generation", 0, 1)
+
+def current_generation() -> int:
+    values = _generation.get("generation")
+    return int(values[0]) if values is not None else 0
+
+class BuildArtifact(Generic[T]):
+    """
+    In-memory copy of a build artifact. It's only read from disk again once a newer build finished
+    """
+
+    def __init__(self, data_folder: Path, name: str, parse: Callable[[object], T] = lambda value: value):
+        self.path = data_folder / ARTIFACTS_FOLDER / (name + ".json")
+        self.parse = parse
+        self._generation = None
+        self._value = None
+
+    def get(self) -> Optional[T]:
+        generation = current_generation()
+        if self._value is None or self._generation != generation:
+            try:
+                with open(self.path) as fd:
+                    self._value = self.parse(json.load(fd))
+            except (OSError, json.JSONDecodeError):
+                self._value = None
+            self._generation = generation
+
+        return self._value
@@ -0,0 +1,85 @@
+from typing import Dict, Iterator, List
+from pathlib import Path
+import io
+import json
+import tarfile
+
+LISTING_NAME = "store.json"
+
+class ChunkWriter:
+    """
+    File-like object collecting everything written to it, so a tar stream can be handed out piece by piece
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def select_entries(store: Dict[str, List[Dict]], folders: List[str], files: List[str]) -> Dict[str, List[Dict]]:
+    """
+    Filter a store listing down to whole folders and single `<folder>/<file>` entries
+    """
+    selected = {}
+    for folder, entries in store.items():
+        chosen = [ entry for entry in entries if folder in folders or f"{folder}/{entry['file']}" in files ]
+        if chosen:
+            selected[folder] = chosen
+
+    return selected
+
+def add_to_bundle(tar: tarfile.TarFile, path: Path, folder: str, entry: Dict):
+    tar.add(path, arcname = f"{folder}/{entry['file']}", recursive = False)
+
+def add_listing(tar: tarfile.TarFile, store: Dict[str, List[Dict]]):
+    listing = json.dumps(store).encode()
+    info = tarfile.TarInfo(LISTING_NAME)
+    info.size = len(listing)
+    tar.addfile(info, io.BytesIO(listing))
+
+def write_bundle(path: Path, content_folder: Path, store: Dict[str, List[Dict]]):
+    """
+    Write a gzipped tar with the given store entries and their listing as `store.json`
+    """
+    temp_file = path.with_name(path.name + ".tmp")
+    with tarfile.open(temp_file, "w:gz") as tar:
+        add_listing(tar, store)
+        for folder, entries in store.items():
+            for entry in entries:
+                add_to_bundle(tar, content_folder / folder / entry["file"], folder, entry)
+
+    temp_file.replace(path)
+
+def stream_bundle(by_hash_folder: Path, store: Dict[str, List[Dict]]) -> Iterator[bytes]:
+    """
+    Same as `write_bundle`, but yields the archive while it's being built instead of staging it on disk. Files are
+    read from their content addressed copies, so a rebuild swapping the content folder mid-stream can't mix builds
+    """
+    writer = ChunkWriter()
+    with tarfile.open(fileobj = writer, mode = "w|gz") as tar:
+        add_listing(tar, store)
+        for folder, entries in store.items():
+            for entry in entries:
+                add_to_bundle(tar, by_hash_folder / entry["hash"], folder, entry)
+
+                # the compressor buffers internally, so most files don't produce output right away
+                chunk = writer.pop()
+                if chunk:
+                    yield chunk
+
+    yield writer.pop()
+
+def prune_bundles(bundles_folder: Path, keep: int = 2):
+    """
+    Delete all but the `keep` newest bundles, so clients still downloading the previous one aren't cut off
+    """
+    bundles = sorted(bundles_folder.glob("*.tar.gz"), key = lambda bundle: bundle.stat().st_mtime, reverse = True)
+    for bundle in bundles[keep:]:
+        bundle.unlink()
@@ -2,29 +2,59 @@ import sqlite3
 import atexit
 import config
 from pathlib import Path
-import uwsgidecorators
 import queue
 import time
+import threading
+
+try:
+    import uwsgidecorators
+except ImportError:
+    # not running under uwsgi, e.g. the flask development server or the benchmark
+    uwsgidecorators = None
+
+from metrics import Counter, Gauge, Histogram, worker_id, worker_ids
+import blocking
 
 master_queue = queue.Queue()
 db_map: dict[str, 'async_database'] = {}
 
-@uwsgidecorators.postfork
-@uwsgidecorators.thread
+QUEUE_DEPTH = Gauge("database_queue_depth", "Number of queries waiting in a worker's database queue", ("worker",))
+QUERY_DURATION = Histogram("database_query_duration_seconds", "Time spent executing a queued query", ("database", "operation"))
+QUERY_RETRIES = Counter("database_query_retries_total", "Number of queries put back into the queue because the database was locked", ("database",))
+QUERY_FAILURES = Counter("database_query_failures_total", "Number of queries that failed", ("database",))
+
 def database_worker():
+    # the queue of a worker that died or was reloaded is gone, its replacement starts out empty
+    QUEUE_DEPTH.set(0, worker = worker_id())
+
     while True:
         item = master_queue.get() # wait for element to be available
         # get database
         db = db_map[item[0]]
         # process query
-        result = db._process_queue_item(item[1])
+        with QUERY_DURATION.time(database = db.name, operation = item[1][2]):
+            result = db._process_queue_item(item[1])
         if result == 'retry':
+            QUERY_RETRIES.inc(database = db.name)
             master_queue.put(item) # put item back into queue
             time.sleep(db.retry_period)
         elif result == 'failed':
+            QUERY_FAILURES.inc(database = db.name)
             print("Query failed.")
 
         master_queue.task_done()
+        QUEUE_DEPTH.set(master_queue.qsize(), worker = worker_id())
+
+def total_queue_depth() -> float:
+    """
+    Number of queries waiting in the database queues of all workers
+    """
+    return sum(QUEUE_DEPTH.get(worker = worker) for worker in worker_ids())
+
+if uwsgidecorators is not None:
+    uwsgidecorators.postfork(uwsgidecorators.thread(database_worker))
+else:
+    threading.Thread(target = database_worker, daemon = True).start()
 
 
 class async_database:
@@ -39,7 +69,8 @@ class async_database:
         db_map[name] = self
 
     def put(self, item):
-        master_queue.put((self.name, item))    
+        master_queue.put((self.name, item))
+        QUEUE_DEPTH.set(master_queue.qsize(), worker = worker_id())
 
     def fetchone(self, query, data, callback):
         self.put((query, data, 'fetchone', callback))
@@ -64,20 +95,29 @@ class async_database:
         self._database.close()
         del db_map[self.name]
 
+    def _run_query(self, item):
+        query_result = self._database.execute(item[0], item[1])
+        match item[2]:
+            case 'fetchone':
+                return query_result.fetchone()
+            case 'fetchall':
+                return query_result.fetchall()
+            case 'commit':
+                self._database.commit()
+            case 'update':
+                self._database.execute(item[0], item[1])
+                self._database.commit()
+
     def _process_queue_item(self, item):
         try:
-            query_result = self._database.execute(item[0], item[1])
+            # sqlite waits for locks held by other workers, which must not stall a gevent worker.
+            # callbacks queue more queries, so they run back on the calling thread
+            result = blocking.call(self._run_query, item)
             match item[2]:
-                case 'fetchone':
-                    item[3](query_result.fetchone())
-                case 'fetchall':
-                    item[3](query_result.fetchall())
+                case 'fetchone' | 'fetchall':
+                    item[3](result)
                 case 'commit':
-                    self._database.commit()
                     item[3]()
-                case 'update':
-                    self._database.execute(item[0], item[1])
-                    self._database.commit()
         except sqlite3.OperationalError as e:
             self.error_callback(e)
             print(e, item)
@@ -100,7 +140,7 @@ def define_database(name, tables, path=None, *, queue_period = 0.1, retry_period
     # connect to database
     db = sqlite3.connect(db_file, check_same_thread = False)
 
-    db_object = async_database(name, db, queue_period = queue_period, retry_period = retry_period)
+    db_object = async_database(name, db, queue_period = queue_period, retry_period = retry_period, error_callback = error_callback)
 
     # build database structure
     for table_name, structure in tables.items():
@@ -0,0 +1,95 @@
+from typing import List, Optional
+from pathlib import Path
+import subprocess
+
+from api.impl.imhex.build import git_head
+
+MIRROR_MODES = [ "full", "shallow", "blobless" ]
+
+def git(repo_dir: Path, *args: str) -> subprocess.CompletedProcess:
+    return subprocess.run([ "git", *args ], cwd = repo_dir, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+
+def fetch_arguments(mode: str) -> List[str]:
+    """
+    Extra arguments for clone and fetch so they only transfer what the mirror mode needs
+    """
+    if mode == "shallow":
+        return [ "--depth", "1" ]
+    elif mode == "blobless":
+        return [ "--filter=blob:none" ]
+    elif mode == "full":
+        return []
+    else:
+        raise ValueError(f"Invalid mirror mode {mode}, expected one of {MIRROR_MODES}")
+
+def clone(url: str, repo_dir: Path, branch: str, mode: str):
+    """
+    Clone only `branch` of a repository, including its submodules
+    """
+    arguments = [ "clone", "--branch", branch, "--single-branch", "--no-tags", "--recurse-submodules", *fetch_arguments(mode) ]
+    if mode == "shallow":
+        arguments.append("--shallow-submodules")
+    elif mode == "blobless":
+        arguments.append("--also-filter-submodules")
+
+    repo_dir.parent.mkdir(parents = True, exist_ok = True)
+    result = git(repo_dir.parent, *arguments, url, repo_dir.name)
+    if result.returncode != 0:
+        print(result.stderr.decode())
+
+def submodule_paths(repo_dir: Path) -> List[str]:
+    result = git(repo_dir, "config", "--file", ".gitmodules", "--get-regexp", r"submodule\..*\.path")
+    if result.returncode != 0:
+        return []
+
+    return [ line.split(" ", 1)[1] for line in result.stdout.decode().splitlines() if " " in line ]
+
+def changed_paths(repo_dir: Path, old_revision: Optional[str], new_revision: str) -> Optional[List[str]]:
+    """
+    Paths that differ between two revisions, or None if that can't be determined
+    """
+    if old_revision is None:
+        return None
+
+    result = git(repo_dir, "diff", "--name-only", "--no-renames", old_revision, new_revision)
+    if result.returncode != 0:
+        return None
+
+    return result.stdout.decode().splitlines()
+
+def update(repo_dir: Path, branch: str, mode: str) -> str:
+    """
+    Bring the mirror up to date with `branch` on the remote, fetching only that branch and only updating the
+    submodules whose commits changed. Returns the new head revision
+    """
+    old_revision = git_head(repo_dir)
+
+    remote_ref = f"refs/remotes/origin/{branch}"
+    result = git(repo_dir, "fetch", "--no-tags", *fetch_arguments(mode), "origin", f"+refs/heads/{branch}:{remote_ref}")
+    if result.returncode != 0:
+        raise RuntimeError(f"Fetching {branch} failed: {result.stderr.decode()}")
+
+    new_revision = git(repo_dir, "rev-parse", remote_ref).stdout.decode().strip()
+
+    # shallow mirrors don't have the history to tell. Only informational, a forced push is mirrored all the same
+    if mode != "shallow" and old_revision is not None and old_revision != new_revision:
+        if git(repo_dir, "merge-base", "--is-ancestor", old_revision, new_revision).returncode != 0:
+            print(f"{branch} was not fast-forwarded from {old_revision}, resetting to {new_revision}")
+
+    paths = changed_paths(repo_dir, old_revision, new_revision)
+
+    git(repo_dir, "reset", "--hard", new_revision)
+    git(repo_dir, "clean", "-fd")
+
+    submodules = submodule_paths(repo_dir)
+    if paths is not None and ".gitmodules" not in paths:
+        submodules = [ submodule for submodule in submodules if submodule in paths ]
+
+    if submodules:
+        print(f"Updating submodules {', '.join(submodules)}")
+        git(repo_dir, "submodule", "sync", "--recursive", "--", *submodules)
+        result = git(repo_dir, "submodule", "update", "--init", "--recursive", *fetch_arguments(mode), "--", *submodules)
+        if result.returncode != 0:
+            print(result.stderr.decode())
+
+    return new_revision
@@ -0,0 +1,35 @@
+import time
+import threading
+
+import config
+import outbound
+
+_tag = None
+_fetched_at = 0.0
+_refreshing = threading.Lock()
+
+def fetch_latest_tag() -> str:
+    return outbound.get(f"{config.ImHexApi.GITHUB_API_URL}/repos/WerWolv/ImHex/releases/latest").json()["tag_name"]
+
+def _refresh():
+    global _tag, _fetched_at
+    try:
+        _tag = fetch_latest_tag()
+        _fetched_at = time.time()
+    finally:
+        _refreshing.release()
+
+def latest_tag() -> str:
+    """
+    Get the tag of the latest ImHex release. Only the first call waits for GitHub, afterwards the cached tag is
+    returned and refreshed in the background once it's older than GITHUB_TAG_TTL seconds
+    """
+    global _tag, _fetched_at
+
+    if _tag is None:
+        _tag = fetch_latest_tag()
+        _fetched_at = time.time()
+    elif time.time() - _fetched_at > config.ImHexApi.GITHUB_TAG_TTL and _refreshing.acquire(blocking = False):
+        outbound.submit(_refresh)
+
+    return _tag
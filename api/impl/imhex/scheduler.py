@@ -0,0 +1,168 @@
+from typing import Callable, Optional
+from pathlib import Path
+import os
+import json
+import time
+import fcntl
+import threading
+import traceback
+import contextlib
+
+STATE_FILE = "build_status.json"
+STATE_LOCK_FILE = "build_status.lock"
+RUNNER_LOCK_FILE = "build_runner.lock"
+
+class BuildScheduler:
+    """
+    Coalesces build requests from all worker processes into as few builds as possible
+
+    Every request marks the build as dirty. A single runner thread, started by whichever process found no runner
+    alive, waits until no request came in for `debounce` seconds (but at most `max_delay` seconds since the first
+    one) and then builds. Requests that arrive while a build is running mark it dirty again, so exactly one
+    follow-up build runs afterwards. The state lives in a json file guarded by a file lock, so all processes share it.
+    The runner holds another file lock for as long as it runs, which the kernel releases if its process dies.
+    """
+
+    def __init__(self, data_folder: Path, build: Callable[[], Optional[str]], *, debounce: float = 5, max_delay: float = 60, history_size: int = 20):
+        self.data_folder = data_folder
+        self.build = build
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.history_size = history_size
+
+        # uwsgi may fork the workers while the master runs a build, they must not keep the runner lock alive
+        self._runner_lock = None
+        os.register_at_fork(after_in_child = self._forget_runner_lock)
+
+    def _forget_runner_lock(self):
+        if self._runner_lock is not None:
+            self._runner_lock.close()
+            self._runner_lock = None
+
+    def _release_runner_lock(self):
+        # unlock explicitly, closing would keep the lock alive as long as a forked child still has the file open
+        fcntl.flock(self._runner_lock, fcntl.LOCK_UN)
+        self._runner_lock.close()
+        self._runner_lock = None
+
+    @contextlib.contextmanager
+    def _state(self, write: bool = True):
+        """
+        Lock, load and yield the shared state. It's written back once the block finishes, unless `write` is False
+        """
+        with open(self.data_folder / STATE_LOCK_FILE, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+            try:
+                try:
+                    with open(self.data_folder / STATE_FILE) as fd:
+                        state = json.load(fd)
+                except (OSError, json.JSONDecodeError):
+                    state = { "next_id": 1, "dirty": False, "dirty_since": None, "requested_at": None, "reason": None, "current": None, "history": [] }
+
+                yield state
+
+                if not write:
+                    return
+
+                temp_file = self.data_folder / (STATE_FILE + ".tmp")
+                with open(temp_file, "w") as fd:
+                    json.dump(state, fd)
+                os.replace(temp_file, self.data_folder / STATE_FILE)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _finish(self, state: dict, entry: dict):
+        state["current"] = None
+        state["history"] = ([ entry ] + state["history"])[:self.history_size]
+
+    def request(self, reason: str, immediate: bool = False) -> str:
+        """
+        Request a build. Returns "started" if this process became the runner, "queued" if a runner already exists
+        """
+        now = time.time()
+        with self._state() as state:
+            if not state["dirty"]:
+                state["dirty_since"] = now
+            state["dirty"] = True
+            state["reason"] = reason
+            state["requested_at"] = now - self.debounce if immediate else now
+
+            runner_lock = open(self.data_folder / RUNNER_LOCK_FILE, "w")
+            try:
+                fcntl.flock(runner_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                runner_lock.close()
+                return "queued"
+
+            # the previous runner died, possibly in the middle of a build
+            if state["current"] is not None:
+                self._finish(state, { **state["current"], "status": "abandoned", "finished_at": now })
+
+            self._runner_lock = runner_lock
+
+        threading.Thread(target = self._run, daemon = True).start()
+        return "started"
+
+    def _wait_for_quiet_period(self):
+        while True:
+            with self._state(write = False) as state:
+                if not state["dirty"]:
+                    return
+
+                now = time.time()
+                deadline = min(state["requested_at"] + self.debounce, state["dirty_since"] + self.max_delay)
+
+            if deadline <= now:
+                return
+
+            time.sleep(deadline - now)
+
+    def _run(self):
+        while True:
+            self._wait_for_quiet_period()
+
+            with self._state() as state:
+                if not state["dirty"]:
+                    self._release_runner_lock()
+                    return
+
+                entry = {
+                    "id": state["next_id"],
+                    "status": "running",
+                    "reason": state["reason"],
+                    "requested_at": state["requested_at"],
+                    "started_at": time.time(),
+                    "finished_at": None,
+                    "revision": None,
+                    "error": None
+                }
+
+                state["next_id"] += 1
+                state["dirty"] = False
+                state["dirty_since"] = None
+                state["current"] = entry
+
+            try:
+                entry["revision"] = self.build()
+                entry["status"] = "success"
+            except Exception as e:
+                print(traceback.format_exc())
+                entry["status"] = "failed"
+                entry["error"] = str(e)
+
+            entry["finished_at"] = time.time()
+            with self._state() as state:
+                self._finish(state, entry)
+
+                # nothing new came in during the build, stop the runner while still holding the state lock
+                if not state["dirty"]:
+                    self._release_runner_lock()
+                    return
+
+    def status(self) -> dict:
+        with self._state(write = False) as state:
+            return {
+                "dirty": state["dirty"],
+                "current": state["current"],
+                "history": state["history"]
+            }
@@ -1,11 +1,18 @@
 from dataclasses import dataclass
-from typing import Dict, List
+from typing import Dict, List, Optional, Set, Tuple
 
+import os
 import subprocess
 import shutil
 import hashlib
 from pathlib import Path
 import json
+import asyncio
+import re
+import bisect
+
+import config
+import blocking
 
 
 STORE_FOLDERS = [ "patterns", "includes", "magic", "constants", "yara", "encodings", "nodes", "themes", "disassemblers" ]
@@ -86,38 +93,206 @@ def is_plcli_found() -> bool:
     """
     return shutil.which("plcli") is not None
 
-def gen_store(root_url: str) -> Dict[str, List[Dict]]:
+def shallow_commits(repo_dir: Path) -> Set[str]:
+    """
+    Commits whose parents are missing because the repository is a shallow clone
+    """
+    result = subprocess.run(["git", "rev-parse", "--git-path", "shallow"], cwd=repo_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if result.returncode != 0:
+        return set()
+
+    try:
+        return set((repo_dir / result.stdout.decode().strip()).read_text().split())
+    except OSError:
+        return set()
+
+def folder_revision(repo_dir: Path, folder: str) -> Dict[str, object]:
+    """
+    Get the last commit that touched a folder of the repository and its time, or None for both if that's unknown
+    """
+    result = subprocess.run(["git", "log", "-1", "--format=%H %ct", "--", folder], cwd=repo_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if result.returncode != 0 or not result.stdout.strip():
+        return { "revision": None, "updated_at": None }
+
+    revision, timestamp = result.stdout.decode().split()
+
+    # the oldest commit of a shallow clone looks like it added every file, the folder may have changed long before it
+    if revision in shallow_commits(repo_dir):
+        return { "revision": None, "updated_at": None }
+
+    return { "revision": revision, "updated_at": int(timestamp) }
+
+def hash_folder(folder: Path) -> List[Tuple[Path, str, int]]:
+    """
+    SHA-256 and size of every file in a folder, sorted by name
+    """
+    hashes = []
+    for file in sorted(folder.iterdir()):
+        if not file.is_dir():
+            with open(file, "rb") as fd:
+                content = fd.read()
+            hashes.append((file, hashlib.sha256(content).hexdigest(), len(content)))
+
+    return hashes
+
+def gen_store_index(content_folder: Path, repo_dir: Path) -> Dict[str, Dict]:
     """
-    Generate an object representing the ImHex store, that can be returned by /imhex/store
+    Generate the store listing of a build, with urls relative to the API root, together with per folder stats
+
+    content_folder: folder the build's store content was copied to. Entries point at the content addressed copies
+    made by `publish_by_hash`
     """
 
     if is_plcli_found():
-        patterns_mds = get_all_pattern_metadata(Path(".") / "content" / "imhex" / "patterns")
+        patterns_mds = get_all_pattern_metadata(content_folder / "patterns")
     else:
         patterns_mds = None
 
     store = {}
+    stats = {}
     for folder in STORE_FOLDERS:
         store[folder] = []
-        for file in (Path(".") / "content" / "imhex" / folder).iterdir():
-            if not file.is_dir():
-                with open(file, "rb") as fd:
-                    data = {
-                        "name": Path(file).stem.replace("_", " ").title(),
-                        "file": file.name,
-                        "url": f"{root_url}content/imhex/{folder}/{file.name}",
-                        "hash": hashlib.sha256(fd.read()).hexdigest(),
-                        "folder": Path(file).suffix == ".tar",
-
-                        "authors": [],
-                        "desc": "",
-                        "mime": [],
-                        }
-                    if folder == "patterns" and patterns_mds and file.name in patterns_mds:
-                        md = patterns_mds[file.name]
-                        data["authors"] = md.authors
-                        data["desc"] = md.description
-                        data["mime"] = md.mimes
-                    store[folder].append(data)
-
-    return store
+        size = 0
+        for file, file_hash, file_size in blocking.call(hash_folder, content_folder / folder):
+            size += file_size
+            data = {
+                "name": Path(file).stem.replace("_", " ").title(),
+                "file": file.name,
+                "url": f"content/{config.Common.CONTENT_BY_HASH_FOLDER}/{file_hash}",
+                "hash": file_hash,
+                "folder": Path(file).suffix == ".tar",
+
+                "authors": [],
+                "desc": "",
+                "mime": [],
+                }
+            if folder == "patterns" and patterns_mds and file.name in patterns_mds:
+                md = patterns_mds[file.name]
+                data["authors"] = md.authors
+                data["desc"] = md.description
+                data["mime"] = md.mimes
+            store[folder].append(data)
+
+        stats[folder] = {
+            "count": len(store[folder]),
+            "size": size,
+            **folder_revision(repo_dir, folder)
+        }
+
+    return { "store": store, "stats": stats }
+
+def store_hashes(store: Dict[str, List[Dict]]) -> Set[str]:
+    return { entry["hash"] for entries in store.values() for entry in entries }
+
+def publish_by_hash(content_folder: Path, store: Dict[str, List[Dict]], by_hash_folder: Path):
+    """
+    Make every file of the store available under its SHA-256 in `by_hash_folder`. Files are hard linked if possible
+    """
+    by_hash_folder.mkdir(parents=True, exist_ok=True)
+
+    for folder, entries in store.items():
+        for entry in entries:
+            target = by_hash_folder / entry["hash"]
+            if target.exists():
+                continue
+
+            # link or copy under a temporary name first, so a half written file is never served under its hash
+            temp_file = by_hash_folder / (entry["hash"] + ".tmp")
+            temp_file.unlink(missing_ok=True)
+            try:
+                os.link(content_folder / folder / entry["file"], temp_file)
+            except OSError:
+                shutil.copyfile(content_folder / folder / entry["file"], temp_file)
+            os.replace(temp_file, target)
+
+def prune_by_hash(by_hash_folder: Path, keep: Set[str]):
+    """
+    Remove all content addressed files whose hash isn't in `keep`
+    """
+    for file in by_hash_folder.iterdir():
+        if file.name not in keep:
+            file.unlink()
+
+def normalize_mime(mime: str) -> str:
+    return mime.split(";", 1)[0].strip().lower()
+
+def name_tokens(text: str) -> List[str]:
+    return [ token for token in re.split(r"[^a-z0-9]+", text.lower()) if token ]
+
+class StoreIndex:
+    """
+    Store listing and stats of the current build, as loaded by every worker, with lookup tables by MIME type and name
+    """
+
+    def __init__(self, index: Dict[str, Dict]):
+        self.revision = index.get("revision")
+        self.store = index["store"]
+        self.stats = index["stats"]
+        self.total = {
+            "count": sum(folder["count"] for folder in self.stats.values()),
+            "size": sum(folder["size"] for folder in self.stats.values())
+        }
+        # only the listing of the last API root is kept, the root comes from the client's Host header
+        self._rendered: Tuple[Optional[str], Optional[Dict[str, List[Dict]]]] = (None, None)
+
+        # entries are referenced by their folder and position in it
+        self._by_mime: Dict[str, List[Tuple[str, int]]] = {}
+        self._by_token: Dict[str, Set[Tuple[str, int]]] = {}
+        for folder, entries in self.store.items():
+            for i, entry in enumerate(entries):
+                for mime in entry["mime"]:
+                    self._by_mime.setdefault(normalize_mime(mime), []).append((folder, i))
+                for token in name_tokens(entry["name"]) + name_tokens(Path(entry["file"]).stem):
+                    self._by_token.setdefault(token, set()).add((folder, i))
+
+        # sorted, so all tokens starting with a prefix can be found with a binary search
+        self._tokens = sorted(self._by_token.keys())
+
+    def _prefix_matches(self, prefix: str) -> Set[Tuple[str, int]]:
+        matches = set()
+        for i in range(bisect.bisect_left(self._tokens, prefix), len(self._tokens)):
+            if not self._tokens[i].startswith(prefix):
+                break
+            matches |= self._by_token[self._tokens[i]]
+        return matches
+
+    def lookup_mime(self, root_url: str, mime: str) -> List[Dict]:
+        """
+        Get the entries that handle a MIME type
+        """
+        return [ self._render_entry(root_url, self.store[folder][i]) for folder, i in self._by_mime.get(normalize_mime(mime), []) ]
+
+    def search(self, root_url: str, query: str, folder: Optional[str] = None, limit: int = 10) -> List[Dict]:
+        """
+        Get the entries whose name contains words starting with every word of the query
+        """
+        tokens = name_tokens(query)
+        if not tokens:
+            return []
+
+        matches = self._prefix_matches(tokens[0])
+        for token in tokens[1:]:
+            matches &= self._prefix_matches(token)
+
+        if folder is not None:
+            matches = { match for match in matches if match[0] == folder }
+
+        return [ self._render_entry(root_url, self.store[folder][i]) for folder, i in sorted(matches)[:limit] ]
+
+    @staticmethod
+    def _render_entry(root_url: str, entry: Dict) -> Dict:
+        return { **entry, "url": root_url + entry["url"] }
+
+    def render(self, root_url: str) -> Dict[str, List[Dict]]:
+        """
+        Get the store listing that's returned by /imhex/store, with absolute urls for the given API root
+        """
+        rendered_root_url, rendered = self._rendered
+        if rendered_root_url != root_url:
+            rendered = {
+                folder: [ self._render_entry(root_url, entry) for entry in entries ]
+                for folder, entries in self.store.items()
+            }
+            self._rendered = (root_url, rendered)
+
+        return rendered
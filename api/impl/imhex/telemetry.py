@@ -1,5 +1,6 @@
 from api.impl.imhex.database import define_database, do_update
 import config
+import outbound
 from datetime import date, datetime, timedelta
 
 # telemetry database
@@ -35,12 +36,15 @@ telemetry_tables = {
 }
 
 def log_db_error(e):
-    import requests
+    if not config.ImHexApi.DATABASE_ERROR_WEBHOOK:
+        return
+
     form_data = {
         "content": f"```Database encountered error: {e}```"
     }
 
-    requests.post(config.ImHexApi.DATABASE_ERROR_WEBHOOK, data=form_data)
+    # called from the database worker, which shouldn't wait for the webhook before retrying
+    outbound.post_in_background(config.ImHexApi.DATABASE_ERROR_WEBHOOK, data=form_data)
 
 telemetry_db = define_database("imhex/telemetry", telemetry_tables,
                             queue_period=config.ImHexApi.DATABASE_QUEUE_PERIOD,
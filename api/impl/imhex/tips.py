@@ -0,0 +1,44 @@
+from typing import Dict, List, Optional
+from pathlib import Path
+from datetime import date
+import json
+import random
+
+DEFAULT_LANGUAGE = "en_US"
+
+def compile_tips(tips_folder: Path) -> Dict[str, List[str]]:
+    """
+    Collect the tips of all files in the tips folder, grouped by their language
+
+    Each list is shuffled with a fixed seed, which makes it the rotation schedule: day n shows tip n modulo the
+    number of tips, so every tip is shown once before any repeats and all processes agree on the tip of the day
+    """
+    languages = {}
+    for file in sorted(tips_folder.iterdir()):
+        if file.name == "_schema.json" or file.suffix != ".json":
+            continue
+
+        with open(file) as fd:
+            json_data = json.load(fd)
+            languages.setdefault(json_data.get("lang", DEFAULT_LANGUAGE), []).extend(json_data["tips"])
+
+    for language, tips in languages.items():
+        random.Random(language).shuffle(tips)
+
+    return languages
+
+def tip_of_the_day(languages: Dict[str, List[str]], day: date, language: Optional[str]) -> Optional[str]:
+    """
+    Look up the tip for a day, in the requested language if there are tips for it
+    """
+    tips = languages.get(language) if language else None
+
+    # fall back from e.g. "de" to "de_DE", and from there to the default language
+    if not tips and language:
+        tips = next((tips for name, tips in sorted(languages.items()) if name.split("_")[0] == language.split("_")[0]), None)
+    if not tips:
+        tips = languages.get(DEFAULT_LANGUAGE) or next(iter(languages.values()), None)
+    if not tips:
+        return None
+
+    return tips[day.toordinal() % len(tips)]
@@ -0,0 +1,294 @@
+"""
+Replay a JSONL trace of requests against the API and report latency percentiles and throughput per endpoint.
+
+Every line of the trace is one request:
+
+    {"name": "telemetry", "method": "POST", "path": "/imhex/telemetry", "json": {"uuid": "{uuid}", ...}}
+    {"name": "crash_upload", "method": "POST", "path": "/imhex/crash_upload", "file": {"filename": "crash.log", "content": "..."}}
+    {"name": "pattern_hook", "method": "POST", "path": "/imhex/pattern_hook", "body": "{}", "sign": true}
+
+Optional keys are `headers`, `repeat` (send the request n times) and `name` (defaults to "<method> <path>").
+String values of "{uuid}" are replaced by a fresh uuid for every request.
+
+Usage:
+    python -m bench.replay bench/traces/sample.jsonl                   # in-process, using flask's test client
+    python -m bench.replay bench/traces/sample.jsonl --uwsgi 5         # against a local uwsgi with 5 workers
+    python -m bench.replay bench/traces/sample.jsonl --uwsgi 5 --gevent 100   # same, with gevent workers
+    python -m bench.replay bench/traces/sample.jsonl --url http://...  # against an already running server
+
+git, plcli, GitHub and the webhooks are replaced by stubs, so runs are reproducible and don't need network access.
+Use --output to save the results and --compare to diff a run against a saved one.
+"""
+
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import hmac
+import socket
+import hashlib
+import argparse
+import tempfile
+import shutil
+import subprocess
+
+from bench import stubs
+
+repo_root = Path(__file__).resolve().parent.parent
+
+def load_trace(path: Path) -> List[dict]:
+    entries = []
+    with open(path) as fd:
+        for line in fd:
+            line = line.strip()
+            if not line:
+                continue
+
+            entry = json.loads(line)
+            entry.setdefault("method", "GET")
+            entry.setdefault("name", f"{entry['method']} {entry['path']}")
+            entries += [entry] * entry.get("repeat", 1)
+
+    return entries
+
+def substitute(value):
+    if value == "{uuid}":
+        return str(uuid.uuid4())
+    if isinstance(value, dict):
+        return { key: substitute(item) for key, item in value.items() }
+    if isinstance(value, list):
+        return [ substitute(item) for item in value ]
+    return value
+
+def prepare_request(entry: dict, secret: bytes) -> dict:
+    """
+    Turn a trace entry into the method, path, headers, body and file of a request
+    """
+    headers = dict(entry.get("headers", {}))
+    body = None
+
+    if "json" in entry:
+        body = json.dumps(substitute(entry["json"])).encode()
+        headers["Content-Type"] = "application/json"
+    elif "body" in entry:
+        body = entry["body"].encode()
+
+    if entry.get("sign") and body is not None:
+        headers["X-Hub-Signature"] = "sha1=" + hmac.new(secret, body, hashlib.sha1).hexdigest()
+
+    file = None
+    if "file" in entry:
+        file = (entry["file"].get("filename", "file"), entry["file"]["content"].encode())
+
+    return { "method": entry["method"], "path": entry["path"], "headers": headers, "body": body, "file": file }
+
+class InProcessClient:
+    def __init__(self):
+        from server import app
+        self.client = app.test_client()
+
+    def send(self, request: dict) -> int:
+        kwargs = { "method": request["method"], "headers": request["headers"] }
+        if request["file"] is not None:
+            filename, content = request["file"]
+            kwargs["data"] = { "file": (io.BytesIO(content), filename) }
+            kwargs["content_type"] = "multipart/form-data"
+        elif request["body"] is not None:
+            kwargs["data"] = request["body"]
+
+        response = self.client.open(request["path"], **kwargs)
+        response.close()
+        return response.status_code
+
+class HttpClient:
+    def __init__(self, base_url: str):
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+
+    def send(self, request: dict) -> int:
+        files = None
+        if request["file"] is not None:
+            filename, content = request["file"]
+            files = { "file": (filename, content) }
+
+        response = self.session.request(request["method"], self.base_url + request["path"], headers = request["headers"], data = request["body"], files = files)
+        return response.status_code
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+def run(client, entries: List[dict], secret: bytes, concurrency: int) -> dict:
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+
+    def send(entry):
+        request = prepare_request(entry, secret)
+        start = time.perf_counter()
+        try:
+            status = client.send(request)
+            failed = not 200 <= status < 400
+        except Exception as e:
+            print(f"{entry['name']}: {e}")
+            failed = True
+        return entry["name"], time.perf_counter() - start, failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers = concurrency) as executor:
+        for name, latency, failed in executor.map(send, entries):
+            latencies.setdefault(name, []).append(latency)
+            errors[name] = errors.get(name, 0) + int(failed)
+    elapsed = time.perf_counter() - start
+
+    results = {}
+    for name, values in sorted(latencies.items()):
+        results[name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99),
+            "rps": len(values) / elapsed,
+        }
+
+    all_values = [ value for values in latencies.values() for value in values ]
+    results["total"] = {
+        "count": len(all_values),
+        "errors": sum(errors.values()),
+        "p50": percentile(all_values, 0.50),
+        "p95": percentile(all_values, 0.95),
+        "p99": percentile(all_values, 0.99),
+        "rps": len(all_values) / elapsed,
+    }
+
+    return results
+
+def print_results(results: dict, baseline: dict = None):
+    print(f"{'endpoint':<32} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>10}")
+    for name, result in results.items():
+        line = f"{name:<32} {result['count']:>7} {result['errors']:>7} {result['p50'] * 1000:>9.2f} {result['p95'] * 1000:>9.2f} {result['p99'] * 1000:>9.2f} {result['rps']:>10.1f}"
+
+        if baseline is not None and name in baseline:
+            before = baseline[name]
+            changes = [ (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0 for key in ("p50", "p95", "rps") ]
+            line += "   (p50 {:+.1f}%, p95 {:+.1f}%, req/s {:+.1f}%)".format(*changes)
+
+        print(line)
+
+def prepare_environment(workdir: Path, stub_url: str, pattern_count: int):
+    """
+    Point the app at a scratch data and content folder with a fake ImHex-Patterns checkout and stubbed outbound services
+    """
+    os.environ["DATA_FOLDER"] = str(workdir / "data")
+    os.environ["CONTENT_FOLDER"] = str(workdir / "content")
+    os.environ.setdefault("COMMON_SECRET", "benchmark")
+    os.environ.setdefault("IMHEXAPI_SECRET", "benchmark")
+    os.environ["CRASH_WEBHOOK"] = f"{stub_url}/webhook/crash"
+    os.environ["DATABASE_ERROR_WEBHOOK"] = f"{stub_url}/webhook/database"
+    os.environ["GITHUB_API_URL"] = stub_url
+
+    # all traffic comes from the same address, don't let the rate limits skew the measurement
+    for key in ("TELEMETRY_RATE", "TELEMETRY_BURST", "CRASH_UPLOAD_RATE", "CRASH_UPLOAD_BURST"):
+        os.environ.setdefault(key, "1000000")
+    os.environ["PATH"] = str(stubs.create_fake_tools(workdir)) + os.pathsep + os.environ["PATH"]
+
+    sys.path.insert(0, str(repo_root))
+    os.makedirs(workdir / "content" / "imhex", exist_ok = True)
+    stubs.create_patterns_fixture(workdir / "data", pattern_count)
+
+def wait_for_build(workdir: Path):
+    """
+    The store is built in the background on startup, wait for it so it isn't part of the measurement
+    """
+    from api.impl.imhex.build import MANIFEST_FILE
+
+    for _ in range(6000):
+        if (workdir / "data" / "imhex" / MANIFEST_FILE).exists():
+            return
+        time.sleep(0.1)
+
+    raise RuntimeError("Store build didn't finish")
+
+def start_uwsgi(processes: int, gevent: int = 0) -> Tuple[subprocess.Popen, str]:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    arguments = [ "uwsgi", "--http", f"127.0.0.1:{port}", "--http-keepalive", "--master", "--processes", str(processes), "--enable-threads", "--die-on-term", "--disable-logging", "-w", "wsgi:app" ]
+    if gevent:
+        arguments += [ "--gevent", str(gevent), "--gevent-early-monkey-patch" ]
+
+    process = subprocess.Popen(arguments, cwd = repo_root, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+
+    import requests
+    for _ in range(600):
+        try:
+            requests.get(base_url, timeout = 1)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+
+    process.terminate()
+    raise RuntimeError("uwsgi didn't come up")
+
+def main():
+    parser = argparse.ArgumentParser(description = "Replay a JSONL request trace against the API")
+    parser.add_argument("trace", type = Path)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--uwsgi", type = int, metavar = "PROCESSES", help = "start a local uwsgi with this many workers instead of running in-process")
+    target.add_argument("--url", help = "replay against an already running server instead of starting one")
+    parser.add_argument("--gevent", type = int, default = 0, metavar = "ASYNC", help = "run the local uwsgi with this many gevent greenlets per worker")
+    parser.add_argument("--concurrency", type = int, default = 8)
+    parser.add_argument("--warmup", type = int, default = 1, help = "number of unmeasured passes over the trace")
+    parser.add_argument("--patterns", type = int, default = 200, help = "number of patterns in the fake ImHex-Patterns checkout")
+    parser.add_argument("--upstream-delay", type = float, default = 0.0, help = "seconds the stubbed GitHub and webhooks take to answer")
+    parser.add_argument("--output", type = Path, help = "write the results as JSON to this file")
+    parser.add_argument("--compare", type = Path, help = "results of a previous run to compare against")
+    args = parser.parse_args()
+
+    entries = load_trace(args.trace)
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+
+    workdir = Path(tempfile.mkdtemp(prefix = "werwolvapi_bench_"))
+    stub_server = stubs.start_stub_server(args.upstream_delay)
+    uwsgi_process = None
+    try:
+        if args.url is None:
+            prepare_environment(workdir, f"http://127.0.0.1:{stub_server.server_address[1]}", args.patterns)
+
+        if args.url is not None:
+            client = HttpClient(args.url)
+        elif args.uwsgi is not None:
+            uwsgi_process, base_url = start_uwsgi(args.uwsgi, args.gevent)
+            client = HttpClient(base_url)
+        else:
+            client = InProcessClient()
+
+        if args.url is None:
+            wait_for_build(workdir)
+
+        secret = os.environ.get("IMHEXAPI_SECRET", "").encode()
+        for _ in range(args.warmup):
+            run(client, entries, secret, args.concurrency)
+
+        results = run(client, entries, secret, args.concurrency)
+        print_results(results, baseline)
+
+        if args.output is not None:
+            args.output.write_text(json.dumps(results, indent = 4))
+    finally:
+        if uwsgi_process is not None:
+            uwsgi_process.terminate()
+            uwsgi_process.wait()
+        stub_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors = True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import json
+import stat
+import time
+import threading
+
+# stand-in for `git`: the fixture repository is prepared up front, so every command just succeeds
+FAKE_GIT = """#!/bin/sh
+case "$1" in
+    rev-parse) echo "0000000000000000000000000000000000000000" ;;
+esac
+exit 0
+"""
+
+# stand-in for `plcli info -P <folder> -f json`: reports a description, author and MIME type for every pattern
+FAKE_PLCLI = """#!/bin/sh
+printf "{"
+separator=""
+for file in "$3"/*.hexpat; do
+    [ -e "$file" ] || continue
+    name=$(basename "$file" .hexpat)
+    printf '%s"%s.hexpat": {"description": "%s", "authors": ["WerWolv"], "mimes": ["application/x-%s"]}' "$separator" "$name" "$name" "$name"
+    separator=", "
+done
+printf "}"
+exit 0
+"""
+
+def create_fake_tools(folder: Path) -> Path:
+    """
+    Write fake `git` and `plcli` executables into `folder/bin` and return that folder, so it can be prepended to PATH
+    """
+    bin_folder = folder / "bin"
+    bin_folder.mkdir(parents = True, exist_ok = True)
+
+    for name, content in (("git", FAKE_GIT), ("plcli", FAKE_PLCLI)):
+        tool = bin_folder / name
+        tool.write_text(content)
+        tool.chmod(tool.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    return bin_folder
+
+def create_patterns_fixture(data_folder: Path, pattern_count: int = 200):
+    """
+    Create a fake ImHex-Patterns checkout in the imhex data folder, with every store folder populated
+    """
+    from api.impl.imhex.store import STORE_FOLDERS
+
+    repo = data_folder / "imhex" / "ImHex-Patterns"
+    for folder in STORE_FOLDERS:
+        (repo / folder).mkdir(parents = True, exist_ok = True)
+        (repo / folder / "_schema.json").write_text("{}")
+
+    for i in range(pattern_count):
+        (repo / "patterns" / f"pattern_{i}.hexpat").write_text(f"#pragma description Pattern {i}\n\nstruct Header {{ u32 magic; u32 size; }};\nHeader header @ 0x00;\n" * 8)
+
+    for i in range(10):
+        (repo / "includes" / "std").mkdir(exist_ok = True)
+        (repo / "includes" / "std" / f"lib_{i}.pat").write_text(f"namespace std {{ fn f{i}() {{ }}; }}\n")
+        (repo / "magic" / f"magic_{i}.mgc").write_bytes(os.urandom(4096))
+        (repo / "constants" / f"constants_{i}.json").write_text(json.dumps({ "name": f"Constants {i}", "values": [] }))
+        (repo / "encodings" / f"encoding_{i}.tbl").write_text("41=A\n42=B\n")
+        (repo / "themes" / f"theme_{i}.json").write_text(json.dumps({ "name": f"Theme {i}" }))
+
+    (repo / "tips").mkdir(exist_ok = True)
+    (repo / "tips" / "_schema.json").write_text("{}")
+    (repo / "tips" / "tips.json").write_text(json.dumps({ "name": "Tips", "tips": [ f"Tip number {i}" for i in range(30) ] }))
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers the outbound requests the API makes: GitHub's latest release lookup and the Discord webhooks
+    """
+    delay = 0.0
+
+    def _reply(self, status: int, body: bytes, content_type: str):
+        time.sleep(self.delay)
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.endswith("/releases/latest"):
+            self._reply(200, json.dumps({ "tag_name": "v1.33.0" }).encode(), "application/json")
+        else:
+            self._reply(404, b"", "text/plain")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._reply(200, b"{}", "application/json")
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(delay: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Start the stub server on a free local port. Every response is delayed by `delay` seconds to simulate slow upstreams
+    """
+    handler = type("DelayedStubHandler", (StubHandler,), { "delay": delay })
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
@@ -0,0 +1,27 @@
+from typing import Callable, TypeVar
+import sys
+
+T = TypeVar("T")
+
+def _gevent_threadpool():
+    if "gevent" not in sys.modules:
+        return None
+
+    from gevent import monkey, get_hub
+    if not monkey.is_module_patched("threading"):
+        return None
+
+    return get_hub().threadpool
+
+def call(function: Callable[..., T], *args, **kwargs) -> T:
+    """
+    Call a function that blocks on disk, CPU or sqlite without holding up other requests. Under gevent's monkey
+    patching it runs on one of gevent's native threads while the calling greenlet waits, otherwise it's called directly
+
+    The function must not start subprocesses, gevent can only watch those from the main thread
+    """
+    threadpool = _gevent_threadpool()
+    if threadpool is None:
+        return function(*args, **kwargs)
+
+    return threadpool.apply(function, args, kwargs)
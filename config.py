@@ -8,10 +8,10 @@ load_dotenv()
 
 def getenv_float(key: str) -> Union[float, None]:
     value = os.getenv(key)
-    if value == None or not value.isdigit():
-        return None
-    else:
+    try:
         return float(value)
+    except (TypeError, ValueError):
+        return None
     
 
 class Common:
@@ -24,6 +24,24 @@ class Common:
     # Folder exposed through the webserver at /content
     CONTENT_FOLDER = os.getenv("CONTENT_FOLDER") or "content"
 
+    # Folder inside the content folder holding files named by their SHA-256, served as immutable at /content/by-hash
+    CONTENT_BY_HASH_FOLDER = "by-hash"
+
+    # Bearer token required to read /metrics. The endpoint is disabled if not set
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+    # Number of token buckets per rate limited endpoint that clients are hashed into
+    RATE_LIMIT_BUCKETS = getenv_float("RATE_LIMIT_BUCKETS") or 16384
+
+    # Seconds clients are asked to wait when requests are rejected because the server is overloaded
+    OVERLOAD_RETRY_AFTER = getenv_float("OVERLOAD_RETRY_AFTER") or 30
+
+    # Seconds to wait for other services (webhooks, GitHub) before giving up on a request
+    OUTBOUND_TIMEOUT = getenv_float("OUTBOUND_TIMEOUT") or 10
+
+    # Number of outbound requests per worker that may run in the background at the same time
+    OUTBOUND_WORKERS = getenv_float("OUTBOUND_WORKERS") or 16
+
 class ImHexApi:
     # Secret used to verify GitHub's pushes to this API
     SECRET = os.getenv("IMHEXAPI_SECRET").encode()
@@ -31,9 +49,41 @@ class ImHexApi:
     # webhook to ping when we get a new crash
     CRASH_WEBHOOK = os.getenv("CRASH_WEBHOOK")
 
+    # webhook to ping when the telemetry database encounters an error
+    DATABASE_ERROR_WEBHOOK = os.getenv("DATABASE_ERROR_WEBHOOK")
+
+    # GitHub API used to look up the latest ImHex release
+    GITHUB_API_URL = os.getenv("GITHUB_API_URL") or "https://api.github.com"
+
+    # seconds the latest release tag is cached before it's refreshed in the background
+    GITHUB_TAG_TTL = getenv_float("GITHUB_TAG_TTL") or 300
+
     DATABASE_QUEUE_PERIOD = getenv_float("DATABASE_QUEUE_PERIOD") or 0.1
     DATABASE_RETRY_PERIOD = getenv_float("DATABASE_RETRY_PERIOD") or 1
 
+    # Rate limits, in requests per second and burst size, applied per client ip and (for telemetry) per uuid
+    TELEMETRY_RATE = getenv_float("TELEMETRY_RATE") or 0.1
+    TELEMETRY_BURST = getenv_float("TELEMETRY_BURST") or 10
+    CRASH_UPLOAD_RATE = getenv_float("CRASH_UPLOAD_RATE") or 0.05
+    CRASH_UPLOAD_BURST = getenv_float("CRASH_UPLOAD_BURST") or 5
+
+    # Telemetry and crash uploads are rejected while more queries than this are waiting in the database queues of all
+    # workers, or while more crash reports than this are being posted to the webhook
+    MAX_DATABASE_QUEUE_DEPTH = getenv_float("MAX_DATABASE_QUEUE_DEPTH") or 1000
+    MAX_CRASH_WEBHOOKS_IN_FLIGHT = getenv_float("MAX_CRASH_WEBHOOKS_IN_FLIGHT") or 10
+
+    # ImHex-Patterns repository mirrored by the store, and the branch that's built
+    PATTERNS_REPO_URL = os.getenv("PATTERNS_REPO_URL") or "https://github.com/WerWolv/ImHex-Patterns"
+    PATTERNS_BRANCH = os.getenv("PATTERNS_BRANCH") or "master"
+
+    # how much of the repository to fetch: full, shallow (latest commit only) or blobless (history without file contents).
+    # shallow mirrors don't have the history to tell when each store folder last changed, /store/stats reports null then
+    PATTERNS_MIRROR_MODE = os.getenv("PATTERNS_MIRROR_MODE") or "full"
+
+    # seconds without new pushes before the store is rebuilt, and the longest a rebuild may be delayed by new pushes
+    BUILD_DEBOUNCE = getenv_float("BUILD_DEBOUNCE") or 5
+    BUILD_MAX_DELAY = getenv_float("BUILD_MAX_DELAY") or 60
+
 
 def setup():
     os.makedirs(Common.DATA_FOLDER, exist_ok = True)
@@ -0,0 +1,197 @@
+from typing import Dict, Iterable, List
+import time
+import hmac
+import contextlib
+import traceback
+
+from flask import Response, g, request
+
+import config
+from shared import SharedTable
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# every series of every metric lives in this table, so it's aggregated over all uwsgi workers.
+# histograms need one value per bucket plus the +Inf bucket and the sum
+_table = SharedTable(capacity = 4096, width = len(DEFAULT_BUCKETS) + 2)
+_registry: Dict[str, "Metric"] = {}
+
+def worker_id() -> int:
+    """
+    Id of the current uwsgi worker, or 0 when not running under uwsgi
+    """
+    try:
+        import uwsgi
+        return uwsgi.worker_id()
+    except ImportError:
+        return 0
+
+def worker_ids() -> range:
+    """
+    Ids of all uwsgi workers, or just 0 when not running under uwsgi
+    """
+    try:
+        import uwsgi
+        return range(1, uwsgi.numproc + 1)
+    except ImportError:
+        return range(0, 1)
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+class Metric:
+    type_ = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        if name in _registry:
+            raise ValueError(f"Metric {name} is already defined")
+
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry[name] = self
+
+    def _key(self, labels: Dict[str, object]) -> str:
+        if set(labels.keys()) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels.keys())}")
+
+        return self.name + "{" + ",".join(f"{name}=\"{_escape(labels[name])}\"" for name in self.labelnames) + "}"
+
+    def _render(self, series: List[tuple]) -> List[str]:
+        return [f"{self.name}{{{labels}}} {_format_value(values[0])}" for labels, values in series]
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        _table.add(self._key(labels), 0, amount)
+
+class Gauge(Metric):
+    type_ = "gauge"
+
+    def set(self, value: float, **labels):
+        _table.set(self._key(labels), 0, value)
+
+    def inc(self, amount: float = 1, **labels):
+        _table.add(self._key(labels), 0, amount)
+
+    def dec(self, amount: float = 1, **labels):
+        _table.add(self._key(labels), 0, -amount)
+
+    def get(self, **labels) -> float:
+        values = _table.get(self._key(labels))
+        return values[0] if values is not None else 0
+
+class Histogram(Metric):
+    type_ = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+
+        self.buckets = tuple(sorted(buckets))
+        if len(self.buckets) + 2 > _table.width:
+            raise ValueError(f"Histogram {name} has too many buckets")
+
+    def observe(self, value: float, **labels):
+        def record(values):
+            # buckets are stored cumulative, followed by the total count and the sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[len(self.buckets)] += 1
+            values[len(self.buckets) + 1] += value
+            return values
+
+        _table.update(self._key(labels), record)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render(self, series: List[tuple]) -> List[str]:
+        lines = []
+        for labels, values in series:
+            prefix = labels + "," if labels else ""
+            for i, bound in enumerate(self.buckets + (float("inf"),)):
+                lines.append(f"{self.name}_bucket{{{prefix}le=\"{_format_value(bound)}\"}} {_format_value(values[i])}")
+            lines.append(f"{self.name}_sum{{{labels}}} {_format_value(values[len(self.buckets) + 1])}")
+            lines.append(f"{self.name}_count{{{labels}}} {_format_value(values[len(self.buckets)])}")
+        return lines
+
+def render() -> str:
+    """
+    Render all metrics in the Prometheus text exposition format
+    """
+    series: Dict[str, List[tuple]] = {}
+    for key, values in _table.items():
+        name, labels = key.split("{", 1)
+        series.setdefault(name, []).append((labels[:-1], values))
+
+    lines = []
+    for name, metric in sorted(_registry.items()):
+        lines.append(f"# HELP {name} {metric.documentation}")
+        lines.append(f"# TYPE {name} {metric.type_}")
+        lines += metric._render(sorted(series.get(name, [])))
+
+    return "\n".join(lines) + "\n"
+
+# methods are sent by the client, so anything else is recorded as "other" to keep the number of series bounded
+METHODS = ("GET", "POST", "HEAD", "OPTIONS")
+
+REQUEST_DURATION = Histogram("http_request_duration_seconds", "Time spent handling a request", ("route", "method"))
+REQUESTS = Counter("http_requests_total", "Number of handled requests", ("route", "method", "status"))
+
+def init_app(app):
+    """
+    Install the request hooks and the /metrics endpoint on a flask app
+    """
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+
+        # use the rule instead of the path so routes like /content/<path:filename> stay a single series
+        if request.url_rule is not None:
+            route = request.url_rule.rule
+            method = request.method if request.method in METHODS else "other"
+        else:
+            route = "<unmatched>"
+            method = ""
+
+        # metrics must never fail the request they're recorded for
+        try:
+            REQUEST_DURATION.observe(time.perf_counter() - start, route = route, method = method)
+            REQUESTS.inc(route = route, method = method, status = response.status_code)
+        except Exception:
+            print(traceback.format_exc())
+
+        return response
+
+    @app.route("/metrics")
+    def get_metrics():
+        # the endpoint only exists if a token has been configured
+        if not config.Common.METRICS_TOKEN:
+            return Response(status = 404)
+
+        authorization = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(authorization.encode(), f"Bearer {config.Common.METRICS_TOKEN}".encode()):
+            return Response(status = 401)
+
+        return Response(render(), mimetype = "text/plain; version=0.0.4")
@@ -0,0 +1,35 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+import traceback
+
+import requests
+
+import config
+
+# shared, so connections to the same hosts are reused
+session = requests.Session()
+
+# threads are only started on the first submit, so every worker gets its own after uwsgi forked it.
+# Under gevent these threads are greenlets, as long as it patched the standard library before this module was imported
+_executor = ThreadPoolExecutor(max_workers = int(config.Common.OUTBOUND_WORKERS), thread_name_prefix = "outbound")
+
+def get(url: str, **kwargs) -> requests.Response:
+    return session.get(url, timeout = config.Common.OUTBOUND_TIMEOUT, **kwargs)
+
+def post(url: str, **kwargs) -> requests.Response:
+    return session.post(url, timeout = config.Common.OUTBOUND_TIMEOUT, **kwargs)
+
+def submit(function: Callable, *args, **kwargs) -> Future:
+    """
+    Run a function in the background, so the request or thread calling it doesn't wait for the remote end
+    """
+    def run():
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            print(traceback.format_exc())
+
+    return _executor.submit(run)
+
+def post_in_background(url: str, **kwargs) -> Future:
+    return submit(post, url, **kwargs)
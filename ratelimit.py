@@ -0,0 +1,78 @@
+from typing import Callable, Iterable, Optional
+import math
+import time
+import zlib
+import functools
+
+from flask import Response, request
+
+import config
+from shared import SharedTable
+from metrics import Counter
+
+# clients are hashed into a fixed number of token buckets per endpoint and kind of key, which bounds the memory
+# needed no matter how many clients there are. Colliding clients share a bucket
+BUCKET_COUNT = int(config.Common.RATE_LIMIT_BUCKETS)
+
+# room for a handful of endpoints with two kinds of keys each (e.g. client ip and uuid) at half load
+_buckets = SharedTable(capacity = 8 * BUCKET_COUNT, width = 2, key_size = 48)
+
+REJECTED = Counter("rejected_requests_total", "Number of requests rejected by rate limiting or load shedding", ("endpoint", "reason"))
+
+def client_ip() -> str:
+    return request.remote_addr or ""
+
+def take_token(endpoint: str, key: str, rate: float, burst: float) -> float:
+    """
+    Take a token from the bucket of a client. Returns 0 on success, otherwise the seconds until a token is available
+    """
+    bucket = f"{endpoint}:{zlib.crc32(key.encode()) % BUCKET_COUNT}"
+    now = time.time()
+    wait = 0.0
+
+    def refill_and_take(values):
+        nonlocal wait
+
+        tokens, updated_at = values
+        tokens = burst if updated_at == 0 else min(burst, tokens + (now - updated_at) * rate)
+
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+
+        return [ tokens, now ]
+
+    # let requests through if the table ran out of room rather than rejecting everyone
+    _buckets.update(bucket, refill_and_take)
+    return wait
+
+def limit(endpoint: str, rate: float, burst: float, keys: Callable[[], Iterable[Optional[str]]] = lambda: [ client_ip() ], overloaded: Callable[[], bool] = lambda: False):
+    """
+    Rate limit a route with token buckets shared by all workers, one per key returned by `keys` (every key has to have
+    a token left), and reject all requests while `overloaded` returns True
+
+    rate: tokens refilled per second
+    burst: size of each bucket
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if overloaded():
+                REJECTED.inc(endpoint = endpoint, reason = "overloaded")
+                return Response(status = 503, headers = { "Retry-After": str(int(config.Common.OVERLOAD_RETRY_AFTER)) })
+
+            for i, key in enumerate(keys()):
+                if key is None:
+                    continue
+
+                wait = take_token(f"{endpoint}:{i}", key, rate, burst)
+                if wait > 0:
+                    REJECTED.inc(endpoint = endpoint, reason = "rate_limited")
+                    return Response(status = 429, headers = { "Retry-After": str(math.ceil(wait)) })
+
+            return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
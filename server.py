@@ -1,23 +1,39 @@
 import mimetypes
 from pathlib import Path
 import importlib
+import re
 
 import config
+import metrics
 from cache import cache
 
-from flask import Flask, send_from_directory
+from flask import Flask, Response, send_from_directory
 app = Flask(__name__)
 
-cache.init_app(app = app, config={ "CACHE_TYPE": "filesystem", "CACHE_DIR": Path("./data/cache")})
+cache.init_app(app = app, config={ "CACHE_TYPE": "filesystem", "CACHE_DIR": Path(config.Common.DATA_FOLDER) / "cache"})
 cache.clear()
 
+metrics.init_app(app)
+
 @app.route("/")
 def base():
     return "WerWolv's API Endpoints"
 
+@app.route("/content/by-hash/<sha256>")
+def download_content_by_hash(sha256):
+    if re.fullmatch("[0-9a-f]{64}", sha256) is None:
+        return Response(status = 404)
+
+    content_path = Path(app.root_path) / config.Common.CONTENT_FOLDER / config.Common.CONTENT_BY_HASH_FOLDER
+    response = send_from_directory(directory = content_path, path = sha256, as_attachment = True, mimetype = "application/octet-stream", max_age = 31536000)
+
+    # the content of a hash can never change
+    response.cache_control.immutable = True
+    return response
+
 @app.route("/content/<path:filename>")
 def download_content(filename):    
-    content_path = Path(app.root_path) / "content"
+    content_path = Path(app.root_path) / config.Common.CONTENT_FOLDER
     return send_from_directory(directory = content_path, path = filename, as_attachment = True, mimetype="Content-Type: application/octet-stream")
 
 
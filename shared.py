@@ -0,0 +1,155 @@
+import mmap
+import struct
+import zlib
+import multiprocessing
+import contextlib
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+class SharedTable:
+    """
+    Fixed-size table of float rows keyed by short strings, shared between worker processes
+
+    The memory is an anonymous shared mapping created in the constructor. uwsgi imports the app in the
+    master process and forks the workers afterwards (as long as lazy-apps is not enabled), so every worker
+    inherits the same mapping and sees the values written by the others. Tables therefore have to be
+    created at import time.
+
+    The lock is a semaphore that isn't released if a worker gets killed while holding it, so it's only ever
+    waited on for LOCK_TIMEOUT seconds. Updates are skipped and reads come back empty after that.
+    """
+
+    LOCK_TIMEOUT = 0.5
+
+    def __init__(self, capacity: int, width: int, key_size: int = 192):
+        self.capacity = capacity
+        self.width = width
+        self.key_size = key_size
+
+        self._values = struct.Struct(f"{width}d")
+        self._slot_size = key_size + self._values.size
+        self._buffer = mmap.mmap(-1, capacity * self._slot_size)
+        self._lock = multiprocessing.Lock()
+
+        # per process cache of key -> slot, slots are never freed so entries can't go stale
+        self._slots: Dict[str, int] = {}
+        self._full = False
+        self._timed_out = False
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[bool]:
+        """
+        Hold the lock for the duration of the block. Yields False if it couldn't be taken in time
+        """
+        if not self._lock.acquire(timeout = self.LOCK_TIMEOUT):
+            if not self._timed_out:
+                self._timed_out = True
+                print("Timed out waiting for the shared table lock, a worker might have died holding it")
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            self._lock.release()
+
+    def _find(self, key: str, create: bool) -> Optional[int]:
+        """
+        Find the slot of a key using open addressing. Must be called with the lock held
+        """
+        slot = self._slots.get(key)
+        if slot is not None:
+            return slot
+
+        encoded = key.encode("utf-8")
+        if not encoded or len(encoded) > self.key_size:
+            raise ValueError(f"Invalid shared table key: {key}")
+        padded = encoded.ljust(self.key_size, b"\0")
+
+        start = zlib.crc32(encoded) % self.capacity
+        for probe in range(self.capacity):
+            slot = (start + probe) % self.capacity
+            offset = slot * self._slot_size
+            stored = self._buffer[offset:offset + self.key_size]
+
+            if stored == padded:
+                self._slots[key] = slot
+                return slot
+
+            if stored[0] == 0:
+                if not create:
+                    return None
+
+                self._buffer[offset:offset + self.key_size] = padded
+                self._slots[key] = slot
+                return slot
+
+        if create and not self._full:
+            self._full = True
+            print(f"Shared table is full, dropping key {key}")
+
+        return None
+
+    def _read(self, slot: int) -> List[float]:
+        return list(self._values.unpack_from(self._buffer, slot * self._slot_size + self.key_size))
+
+    def _write(self, slot: int, values: List[float]):
+        self._values.pack_into(self._buffer, slot * self._slot_size + self.key_size, *values)
+
+    def update(self, key: str, function: Callable[[List[float]], List[float]]) -> Optional[List[float]]:
+        """
+        Atomically replace the row of a key with the result of `function(row)`. Rows of new keys start out as zeros
+
+        Returns the new row, or None if the table has no room left for the key or the lock timed out
+        """
+        with self._locked() as locked:
+            if not locked:
+                return None
+
+            slot = self._find(key, create = True)
+            if slot is None:
+                return None
+
+            values = function(self._read(slot))
+            self._write(slot, values)
+            return values
+
+    def add(self, key: str, index: int, amount: float = 1) -> Optional[List[float]]:
+        def increment(values):
+            values[index] += amount
+            return values
+
+        return self.update(key, increment)
+
+    def set(self, key: str, index: int, value: float) -> Optional[List[float]]:
+        def assign(values):
+            values[index] = value
+            return values
+
+        return self.update(key, assign)
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._locked() as locked:
+            if not locked:
+                return None
+
+            slot = self._find(key, create = False)
+            if slot is None:
+                return None
+
+            return self._read(slot)
+
+    def items(self) -> List[Tuple[str, List[float]]]:
+        result = []
+        with self._locked() as locked:
+            if not locked:
+                return result
+
+            for slot in range(self.capacity):
+                offset = slot * self._slot_size
+                stored = self._buffer[offset:offset + self.key_size]
+                if stored[0] == 0:
+                    continue
+
+                result.append((stored.rstrip(b"\0").decode("utf-8"), self._read(slot)))
+
+        return result
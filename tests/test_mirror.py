@@ -0,0 +1,87 @@
+from pathlib import Path
+import subprocess
+
+import pytest
+
+from api.impl.imhex import mirror
+
+@pytest.fixture(autouse = True)
+def git_environment(monkeypatch):
+    settings = {
+        "init.defaultBranch": "master",
+        # submodules are cloned from local repositories, and shallow and blobless fetches need these on the remote end
+        "protocol.file.allow": "always",
+        "uploadpack.allowFilter": "true",
+        "uploadpack.allowAnySHA1InWant": "true",
+    }
+    monkeypatch.setenv("GIT_CONFIG_COUNT", str(len(settings)))
+    for i, (key, value) in enumerate(settings.items()):
+        monkeypatch.setenv(f"GIT_CONFIG_KEY_{i}", key)
+        monkeypatch.setenv(f"GIT_CONFIG_VALUE_{i}", value)
+
+    for variable in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{variable}_NAME", "test")
+        monkeypatch.setenv(f"GIT_{variable}_EMAIL", "test@example.com")
+
+def git(repo_dir: Path, *args: str) -> str:
+    return subprocess.run([ "git", *args ], cwd = repo_dir, check = True, stdout = subprocess.PIPE, stderr = subprocess.PIPE).stdout.decode().strip()
+
+def commit_file(repo_dir: Path, name: str, content: str):
+    (repo_dir / name).write_text(content)
+    git(repo_dir, "add", name)
+    git(repo_dir, "commit", "-m", f"Update {name}")
+    git(repo_dir, "push", "origin", "HEAD:master")
+
+def make_remote(tmp_path: Path, name: str) -> Path:
+    """
+    Create a bare repository and a work tree pushing to it
+    """
+    bare = tmp_path / f"{name}.git"
+    git(tmp_path, "init", "--bare", str(bare))
+    git(tmp_path, "clone", bare.as_uri(), name)
+    return tmp_path / name
+
+@pytest.mark.parametrize("mode", mirror.MIRROR_MODES)
+def test_update_only_touches_changed_submodules(tmp_path, monkeypatch, mode):
+    first = make_remote(tmp_path, "first")
+    commit_file(first, "a.hexpat", "1")
+    second = make_remote(tmp_path, "second")
+    commit_file(second, "b.hexpat", "1")
+
+    patterns = make_remote(tmp_path, "patterns")
+    git(patterns, "submodule", "add", (tmp_path / "first.git").as_uri(), "first")
+    git(patterns, "submodule", "add", (tmp_path / "second.git").as_uri(), "second")
+    commit_file(patterns, "README.md", "1")
+
+    repo_dir = tmp_path / "mirror" / "ImHex-Patterns"
+    mirror.clone((tmp_path / "patterns.git").as_uri(), repo_dir, "master", mode)
+    assert (repo_dir / "first" / "a.hexpat").read_text() == "1"
+    assert (repo_dir / "second" / "b.hexpat").read_text() == "1"
+
+    if mode == "shallow":
+        assert git(repo_dir, "rev-parse", "--is-shallow-repository") == "true"
+    elif mode == "blobless":
+        assert git(repo_dir, "config", "remote.origin.partialclonefilter") == "blob:none"
+
+    # bump the first submodule and change a file of the repository itself
+    commit_file(first, "a.hexpat", "2")
+    git(patterns, "submodule", "update", "--remote", "first")
+    git(patterns, "add", "first")
+    commit_file(patterns, "README.md", "2")
+
+    calls = []
+    original_git = mirror.git
+    monkeypatch.setattr(mirror, "git", lambda repo_dir, *args: calls.append(args) or original_git(repo_dir, *args))
+
+    assert mirror.update(repo_dir, "master", mode) == git(patterns, "rev-parse", "HEAD")
+    assert (repo_dir / "README.md").read_text() == "2"
+    assert (repo_dir / "first" / "a.hexpat").read_text() == "2"
+
+    submodule_updates = [ args for args in calls if args[:2] == ("submodule", "update") ]
+    assert len(submodule_updates) == 1
+    assert submodule_updates[0][-2:] == ("--", "first")
+
+    # nothing changed upstream, so no submodule is touched
+    calls.clear()
+    mirror.update(repo_dir, "master", mode)
+    assert not [ args for args in calls if args[:2] == ("submodule", "update") ]
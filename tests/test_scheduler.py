@@ -0,0 +1,55 @@
+import threading
+import time
+
+from api.impl.imhex.scheduler import BuildScheduler
+
+def wait_until_idle(scheduler: BuildScheduler, timeout: float = 10) -> dict:
+    """
+    Wait until no build is running or waiting to run anymore
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = scheduler.status()
+        if not status["dirty"] and status["current"] is None and scheduler._runner_lock is None:
+            return status
+        time.sleep(0.05)
+
+    raise TimeoutError("the scheduler never became idle")
+
+def test_burst_of_requests_is_coalesced_into_one_build(tmp_path):
+    builds = []
+    scheduler = BuildScheduler(tmp_path, lambda: builds.append(1) or "revision", debounce = 0.2, max_delay = 2)
+
+    results = [ scheduler.request(f"push {i}") for i in range(5) ]
+    assert results == [ "started" ] + [ "queued" ] * 4
+
+    status = wait_until_idle(scheduler)
+    assert len(builds) == 1
+    assert [ entry["status"] for entry in status["history"] ] == [ "success" ]
+    assert status["history"][0]["reason"] == "push 4"
+    assert status["history"][0]["revision"] == "revision"
+
+def test_request_during_build_causes_one_follow_up_build(tmp_path):
+    started = threading.Event()
+    release = threading.Event()
+    builds = []
+
+    def build():
+        builds.append(1)
+        started.set()
+        assert release.wait(10)
+        return "revision"
+
+    scheduler = BuildScheduler(tmp_path, build, debounce = 0.1, max_delay = 2)
+    assert scheduler.request("first") == "started"
+    assert started.wait(10)
+
+    # the runner is busy building, so these have to wait for the follow-up build
+    assert scheduler.request("second") == "queued"
+    assert scheduler.request("third") == "queued"
+    assert scheduler.status()["current"]["reason"] == "first"
+    release.set()
+
+    status = wait_until_idle(scheduler)
+    assert len(builds) == 2
+    assert [ (entry["status"], entry["reason"]) for entry in status["history"] ] == [ ("success", "third"), ("success", "first") ]